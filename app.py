@@ -1,7 +1,13 @@
-from flask import Flask, render_template, request, redirect, url_for, session
-from datetime import datetime
+from flask import Flask, g, make_response, render_template, request, redirect, url_for, session
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import wraps
 from models import db, bcrypt, User, Mood, Chat, Alert
+import hashlib
 import random
+import re
 
 app = Flask(__name__)
 app.secret_key = "replace_this_with_a_random_secret"
@@ -11,6 +17,14 @@ app.secret_key = "replace_this_with_a_random_secret"
 # ------------------------
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///saidika.db"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# Pool connections across gunicorn threads so each request reuses a warm
+# connection (with its PRAGMAs already applied) instead of reconnecting.
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "pool_size": 10,
+    "max_overflow": 5,
+    "pool_pre_ping": True,
+    "connect_args": {"check_same_thread": False, "timeout": 30},
+}
 
 db.init_app(app)
 bcrypt.init_app(app)
@@ -18,34 +32,110 @@ bcrypt.init_app(app)
 # ------------------------
 # Helper: Emotion detection
 # ------------------------
+# Multi-pattern matcher built once at import time: a single compiled
+# alternation scans the message in one pass instead of ~30 per-message
+# Python substring searches. Crisis keywords take priority over everything.
+_EMOTION_KEYWORDS = {
+    "crisis": ("hopeless", "tired of life", "give up", "can't go on",
+               "suicide", "kill myself", "end my life", "die"),
+    "happy": ("happy", "great", "good", "excited", "joy", "awesome"),
+    "sad": ("sad", "unhappy", "down", "depressed", "cry", "hurt"),
+    "anxious": ("anxious", "worried", "scared", "nervous", "panic"),
+    "angry": ("angry", "mad", "frustrated", "annoyed"),
+}
+
+_KEYWORD_EMOTION = {w: emo for emo, words in _EMOTION_KEYWORDS.items() for w in words}
+# Longest keywords first so phrases like "kill myself" win over "kill"-style prefixes
+_KEYWORD_RE = re.compile("|".join(
+    re.escape(w) for w in sorted(_KEYWORD_EMOTION, key=len, reverse=True)))
+
 def detect_emotion(text):
-    text = (text or "").lower()
+    # expects already-lowercased text so callers only pay for .lower() once;
+    # one dict probe per matched keyword, bailing out the moment crisis is seen
+    found = None
+    for m in _KEYWORD_RE.finditer(text or ""):
+        emo = _KEYWORD_EMOTION[m.group()]
+        if emo == "crisis":
+            return "crisis"
+        if found is None:
+            found = emo
+    return found or "neutral"
+
+# ------------------------
+# Dummy hash: verified when the email is unknown so login takes the same
+# time (and CPU) whether or not the account exists
+# ------------------------
+_DUMMY_HASH = bcrypt.generate_password_hash("x").decode("utf-8")
 
-    happy_words = ["happy", "great", "good", "excited", "joy", "awesome"]
-    sad_words = ["sad", "unhappy", "down", "depressed", "cry", "hurt"]
-    anxious_words = ["anxious", "worried", "scared", "nervous", "panic"]
-    angry_words = ["angry", "mad", "frustrated", "annoyed"]
-    hopeless_words = ["hopeless", "tired of life", "give up", "can't go on",
-                      "suicide", "kill myself", "end my life", "die"]
+# ------------------------
+# Bot replies (built once at import time, like the keyword matcher above)
+# ------------------------
+_BOT_RESPONSES = {
+    "happy": "😊 That's wonderful! What made you feel good today?",
+    "sad": "😢 I'm sorry you're feeling low. Want to talk about it?",
+    "anxious": "😟 Anxiety can be overwhelming. What's worrying you?",
+    "angry": "😠 Your feelings are valid. What triggered the anger?",
+    "neutral": "🙂 I'm here with you. Tell me more when you're ready.",
+    "crisis": (
+        "🚨 I’m very concerned about your safety. If you feel in danger or are thinking about harming yourself, "
+        "please contact emergency services or a hotline. You deserve care and safety."
+    ),
+}
+
+# Phrase-triggered replies, checked before emotion replies. Lower priority
+# number wins when a message contains phrases from several groups.
+_PHRASE_GROUPS = (
+    (("help", "assist", "support"),
+     "🤝 Of course, I'm here to help you. What’s worrying you the most right now?"),
+    (("not okay", "hurt", "pain"),
+     "💛 I'm really sorry you're feeling this way. You’re not alone — tell me more."),
+    (("alone", "lonely"),
+     "🤍 Feeling alone can be heavy. I'm here with you — you don’t have to carry this alone."),
+)
+_PHRASE_REPLY = {w: (prio, reply)
+                 for prio, (words, reply) in enumerate(_PHRASE_GROUPS)
+                 for w in words}
+_PHRASE_RE = re.compile("|".join(
+    re.escape(w) for w in sorted(_PHRASE_REPLY, key=len, reverse=True)))
+
+def phrase_reply(text):
+    # expects already-lowercased text; one pass over all phrase matches
+    best = None
+    for m in _PHRASE_RE.finditer(text):
+        prio, reply = _PHRASE_REPLY[m.group()]
+        if best is None or prio < best[0]:
+            best = (prio, reply)
+    return best[1] if best else None
 
-    if any(w in text for w in happy_words):
-        return "happy"
-    if any(w in text for w in sad_words):
-        return "sad"
-    if any(w in text for w in anxious_words):
-        return "anxious"
-    if any(w in text for w in angry_words):
-        return "angry"
-    if any(w in text for w in hopeless_words):
-        return "crisis"
+# ------------------------
+# Helper: conditional responses for cheap, rarely-changing pages
+# ------------------------
+def etag_cached(key, render):
+    # Answer 304 when the client already holds the current version, so
+    # repeat hits (e.g. frontend polling) skip template rendering entirely.
+    etag = hashlib.blake2b(key.encode()).hexdigest()[:32]
+    if etag in request.if_none_match:
+        # RFC 7232: a 304 echoes the validator so caches can refresh it
+        resp = app.response_class(status=304)
+        resp.set_etag(etag)
+        return resp
+    resp = make_response(render())
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, max-age=60"
+    return resp
 
-    return "neutral"
+# ------------------------
+# Helper: current user (lazy, cached on g per request)
+# ------------------------
+def current_user():
+    if "g_user" not in g:
+        g.g_user = db.session.get(User, session["user"]) if "user" in session else None
+    return g.g_user
 
 # ------------------------
 # LOGIN PROTECTION decorator
 # ------------------------
 def login_required(fn):
-    from functools import wraps
     @wraps(fn)
     def wrapper(*args, **kwargs):
         if "user" not in session:
@@ -54,9 +144,27 @@ def login_required(fn):
     return wrapper
 
 # ------------------------
-# Ensure DB tables exist
+# SQLite tuning
 # ------------------------
 with app.app_context():
+    # WAL mode: readers no longer block on writers, and commits fsync far less
+    # often than with the default rollback journal.
+    @event.listens_for(db.engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA mmap_size=268435456")
+        cur.execute("PRAGMA cache_size=-65536")
+        cur.close()
+
+# ------------------------
+# Schema setup: run once via `flask init-db` instead of at every import,
+# so gunicorn workers don't each re-introspect the schema (and race) on boot
+# ------------------------
+@app.cli.command("init-db")
+def init_db():
     db.create_all()
 
 # ------------------------
@@ -76,7 +184,7 @@ def register():
         email = request.form.get("email", "").strip()
         password = request.form.get("password", "")
 
-        existing = User.query.filter_by(email=email).first()
+        existing = db.session.scalar(db.select(User).filter_by(email=email))
         if existing:
             error = "Account already exists."
         else:
@@ -96,12 +204,14 @@ def login():
     error = None
     if request.method == "POST":
         email = request.form.get("email", "").strip()
-        password = request.form.get("password")
+        password = request.form.get("password", "")
 
-        user = User.query.filter_by(email=email).first()
+        user = db.session.scalar(db.select(User).filter_by(email=email))
 
-        if user and bcrypt.check_password_hash(user.password, password):
+        hashed = user.password if user else _DUMMY_HASH
+        if bcrypt.check_password_hash(hashed, password) and user:
             session["user"] = user.id
+            session["user_email"] = user.email  # avoids a User lookup on every page
 
             # Clear in-memory UI chat (keeps DB history but not immediately shown in session)
             session.pop("chat_ui", None)
@@ -121,6 +231,7 @@ def login():
 @app.route("/logout")
 def logout():
     session.pop("user", None)
+    session.pop("user_email", None)
     session.pop("chat_ui", None)
     return redirect(url_for("login"))
 
@@ -130,75 +241,86 @@ def logout():
 @app.route("/home")
 @login_required
 def home():
-    # use session-safe get to avoid SQLAlchemy legacy warning
-    user = db.session.get(User, session["user"])
-    email = user.email if user else "Unknown"
-    return render_template("home.html", user=email)
+    # email was stashed in the session at login — no DB hit needed here
+    email = session.get("user_email", "Unknown")
+    return etag_cached(
+        f"home:{session['user']}:{email}",
+        lambda: render_template("home.html", user=email),
+    )
 
 # ------------------------
 # CHAT (AI + crisis detection + DB history)
 # ------------------------
+CHAT_HISTORY_LIMIT = 50
+
+# Crisis alerts are written off the request path so the safety message is
+# not delayed by an extra insert + fsync. Two workers is plenty: crisis
+# messages are rare, and each write is a single-row commit.
+_alert_executor = ThreadPoolExecutor(max_workers=2)
+
+def _persist_alert(user_id, message, ts):
+    # runs on the executor: log failures loudly, or the alert vanishes with
+    # the discarded Future and the advisor never sees the crisis
+    with app.app_context():
+        try:
+            db.session.add(Alert(user_id=user_id, risk="High", message=message, time=ts))
+            db.session.commit()
+        except Exception:
+            app.logger.exception("Failed to persist High-risk alert for user %s", user_id)
+        finally:
+            db.session.remove()
+
+
 @app.route("/chat", methods=["GET", "POST"])
 @login_required
 def chat():
     user_id = session["user"]
 
-    # Load chat history from DB (chronological)
-    db_messages = Chat.query.filter_by(user_id=user_id).order_by(Chat.id.asc()).all()
-    chat_history = [{"sender": m.sender, "text": m.text, "time": m.time} for m in db_messages]
-
-    # If developer wants to hide DB history on login, they can use session flag (optional).
-    # Example: if session.pop("hide_history_on_login", False): chat_history = []
-
+    # POST-Redirect-GET: the POST branch only writes, then redirects; the
+    # history load below runs once, on the follow-up GET.
     if request.method == "POST":
         user_msg = request.form.get("message", "").strip()
         if user_msg:
-            ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            # one clock read per POST; the bot row gets ts + 1µs so timestamps
+            # stay strictly ordered without a second syscall
+            ts = datetime.now()
 
-            # Save user message to DB
+            # Save user message (committed together with the bot reply below)
             db.session.add(Chat(user_id=user_id, sender="user", text=user_msg, time=ts))
-            db.session.commit()
-            chat_history.append({"sender": "user", "text": user_msg, "time": ts})
 
-            # Detect emotion + smart responses
-            emotion = detect_emotion(user_msg)
+            # Detect emotion + smart responses (lowercase once, reuse everywhere)
             t = user_msg.lower()
+            emotion = detect_emotion(t)
 
-            if "help" in t or "assist" in t or "support" in t:
-                bot_reply = "🤝 Of course, I'm here to help you. What’s worrying you the most right now?"
-
-            elif "not okay" in t or "hurt" in t or "pain" in t:
-                bot_reply = "💛 I'm really sorry you're feeling this way. You’re not alone — tell me more."
-
-            elif "alone" in t or "lonely" in t:
-                bot_reply = "🤍 Feeling alone can be heavy. I'm here with you — you don’t have to carry this alone."
-
-            elif emotion == "crisis":
-                bot_reply = (
-                    "🚨 I’m very concerned about your safety. If you feel in danger or are thinking about harming yourself, "
-                    "please contact emergency services or a hotline. You deserve care and safety."
-                )
-
-                # Save alert record (High risk)
-                alert = Alert(user_id=user_id, risk="High", message=user_msg, time=ts)
-                db.session.add(alert)
-                db.session.commit()
-
-            else:
-                responses = {
-                    "happy": "😊 That's wonderful! What made you feel good today?",
-                    "sad": "😢 I'm sorry you're feeling low. Want to talk about it?",
-                    "anxious": "😟 Anxiety can be overwhelming. What's worrying you?",
-                    "angry": "😠 Your feelings are valid. What triggered the anger?",
-                    "neutral": "🙂 I'm here with you. Tell me more when you're ready."
-                }
-                bot_reply = responses.get(emotion, "I'm here with you. Tell me more.")
-
-            # Save bot reply to DB
-            ts2 = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            db.session.add(Chat(user_id=user_id, sender="bot", text=bot_reply, time=ts2))
+            bot_reply = phrase_reply(t)
+            is_crisis = bot_reply is None and emotion == "crisis"
+            if bot_reply is None:
+                bot_reply = _BOT_RESPONSES.get(emotion, "I'm here with you. Tell me more.")
+
+            # Save bot reply, then commit both chat rows in one transaction
+            db.session.add(Chat(user_id=user_id, sender="bot", text=bot_reply,
+                                time=ts + timedelta(microseconds=1)))
             db.session.commit()
-            chat_history.append({"sender": "bot", "text": bot_reply, "time": ts2})
+
+            if is_crisis:
+                # High-risk alert record, written in the background
+                _alert_executor.submit(_persist_alert, user_id, user_msg, ts)
+
+        return redirect(url_for("chat"))
+
+    # Load the last 50 messages from DB (chronological) so render time and
+    # memory stay bounded no matter how long the history grows. Selecting
+    # just the rendered columns yields lightweight Row tuples instead of
+    # full ORM objects, so no per-row dict copy is needed.
+    chat_history = db.session.execute(
+        db.select(Chat.sender, Chat.text, Chat.time)
+        .where(Chat.user_id == user_id)
+        .order_by(Chat.id.desc())
+        .limit(CHAT_HISTORY_LIMIT)
+    ).all()[::-1]
+
+    # If developer wants to hide DB history on login, they can use session flag (optional).
+    # Example: if session.pop("hide_history_on_login", False): chat_history = []
 
     return render_template("chat.html", chat=chat_history)
 
@@ -215,37 +337,49 @@ def tracker():
         if mood:
             entry = Mood(
                 mood=mood,
-                time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                time=datetime.now(),
                 user_id=user_id
             )
             db.session.add(entry)
             db.session.commit()
 
-    moods = Mood.query.filter_by(user_id=user_id).order_by(Mood.id.desc()).all()
+    moods = db.session.scalars(
+        db.select(Mood).filter_by(user_id=user_id).order_by(Mood.id.desc())
+    ).all()
     return render_template("tracker.html", mood_log=moods)
 
 # ------------------------
 # ADVISOR (REAL ALERTS)
 # ------------------------
+ADVISOR_PAGE_SIZE = 100
+
 @app.route("/advisor")
 @login_required
 def advisor():
-    # load all alerts (newest first)
-    alerts = Alert.query.order_by(Alert.id.desc()).all()
+    # load one page of alerts (newest first), eager-loading the user in the
+    # same query; ?before=<id> is the cursor for older pages
+    before = request.args.get("before", type=int)
+    query = db.select(Alert).options(joinedload(Alert.user))
+    if before:
+        query = query.filter(Alert.id < before)
+    alerts = db.session.scalars(
+        query.order_by(Alert.id.desc()).limit(ADVISOR_PAGE_SIZE)
+    ).all()
+
+    # cursor for the "Load older" link; None once the last page is reached
+    next_before = alerts[-1].id if len(alerts) == ADVISOR_PAGE_SIZE else None
 
     formatted = []
     for a in alerts:
-        # use db.session.get to avoid legacy .get warning if you prefer, but a.user will work if relationship exists
-        user = db.session.get(User, a.user_id)
         formatted.append({
-            "email": user.email if user else "Unknown",
+            "email": a.user.email if a.user else "Unknown",
             "message": a.message,
             "risk": a.risk,
             "time": a.time,
             "user_id": a.user_id
         })
 
-    return render_template("advisor.html", alerts=formatted)
+    return render_template("advisor.html", alerts=formatted, next_before=next_before)
 
 # ------------------------
 # THERAPIST REDIRECT PAGE
@@ -265,18 +399,30 @@ def therapist(user_id):
 @login_required
 def report():
     user_id = session["user"]
-    moods = Mood.query.filter_by(user_id=user_id).all()
-
-    labels = ["Happy", "Sad", "Anxious", "Stressed", "Calm"]
-    counts = [
-        sum(1 for m in moods if m.mood == "Happy"),
-        sum(1 for m in moods if m.mood == "Sad"),
-        sum(1 for m in moods if m.mood == "Anxious"),
-        sum(1 for m in moods if m.mood == "Stressed"),
-        sum(1 for m in moods if m.mood == "Calm"),
-    ]
-
-    return render_template("report.html", labels=labels, counts=counts)
+
+    # A cheap MAX(id) probe decides whether the client's cached copy is
+    # still current before any aggregation or rendering happens.
+    last_mood_id = db.session.scalar(
+        db.select(db.func.max(Mood.id)).filter_by(user_id=user_id)
+    )
+
+    def render():
+        # Aggregate in SQL: one GROUP BY returns at most 5 rows instead of
+        # hydrating every Mood row just to count it in Python.
+        rows = dict(
+            db.session.execute(
+                db.select(Mood.mood, db.func.count(Mood.id))
+                .filter_by(user_id=user_id)
+                .group_by(Mood.mood)
+            ).all()
+        )
+
+        labels = ["Happy", "Sad", "Anxious", "Stressed", "Calm"]
+        counts = [rows.get(label, 0) for label in labels]
+
+        return render_template("report.html", labels=labels, counts=counts)
+
+    return etag_cached(f"report:{user_id}:{last_mood_id}", render)
 
 # ------------------------
 # RUN APP
@@ -16,20 +16,35 @@ class User(db.Model):
 class Mood(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     mood = db.Column(db.String(50))
-    time = db.Column(db.String(50))
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    time = db.Column(db.DateTime, server_default=db.func.current_timestamp(), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+
+    # covers the per-user, id-ordered scans in /tracker and /report
+    __table_args__ = (db.Index("ix_mood_user_id_id", "user_id", "id"),)
 
 class Chat(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sender = db.Column(db.String(10))    # user | bot
     text = db.Column(db.Text)
-    time = db.Column(db.String(50))
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    time = db.Column(db.DateTime, server_default=db.func.current_timestamp(), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+
+    # covers the per-user, id-ordered history load in /chat
+    __table_args__ = (db.Index("ix_chat_user_id_id", "user_id", "id"),)
 
 class Alert(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     risk = db.Column(db.String(50))      # High | Moderate | Low
     message = db.Column(db.Text)
-    time = db.Column(db.String(50))
+    time = db.Column(db.DateTime, server_default=db.func.current_timestamp(), index=True)
+
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
+
+def bulk_insert(model, rows):
+    """Insert many rows (list of dicts) in one batched statement + commit.
 
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    Use for imports, seeding and fixtures instead of per-row add/commit,
+    which pays an ORM flush and an fsync for every row.
+    """
+    db.session.bulk_insert_mappings(model, rows)
+    db.session.commit()